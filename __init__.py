@@ -1,6 +1,11 @@
 import bpy
+import os
+
+from bpy.app.handlers import persistent
 from bpy.props import (
         BoolProperty,
+        CollectionProperty,
+        IntProperty,
         StringProperty,
 )
 from bpy_extras.io_utils import (
@@ -26,14 +31,12 @@ if "bpy" in locals():
     import importlib
     if "import_spark_model" in locals():
         importlib.reload(import_spark_model)
+    if "catalog_spark_model" in locals():
+        importlib.reload(catalog_spark_model)
 
 
 @orientation_helper(axis_forward='-Z', axis_up='Y')
-class ImportSparkModel(bpy.types.Operator, ImportHelper):
-    bl_idname = "import_scene.spark_model"
-    bl_label = "Import Spark Model"
-    bl_options = {'PRESET', 'UNDO'}
-
+class ImportSparkModelOptions(ImportHelper):
     filter_glob: StringProperty(default="*.model", options={'HIDDEN'})
     filename_ext = ".model"
 
@@ -43,12 +46,44 @@ class ImportSparkModel(bpy.types.Operator, ImportHelper):
         maxlen=1024,
     )
 
+    weld_vertices: BoolProperty(
+        name="Weld vertices",
+        description="Merge vertices split at normal and UV seams that share position and skin weights",
+        default=False,
+    )
+
     import_actions: BoolProperty(
         name="Import actions",
         description="Load actions and link them to loaded model armature",
         default=True,
     )
 
+    frame_start: IntProperty(
+        name="Start frame",
+        description="First frame of each action to import",
+        min=0,
+        default=0,
+    )
+
+    frame_end: IntProperty(
+        name="End frame",
+        description="Last frame of each action to import, -1 for the end of the action",
+        min=-1,
+        default=-1,
+    )
+
+    frame_step: IntProperty(
+        name="Frame step",
+        description="Import every Nth frame of each action",
+        min=1,
+        default=1,
+    )
+
+    sequence_names: StringProperty(
+        name="Sequences",
+        description="Comma separated names of sequences to import actions for, empty to import all",
+    )
+
     import_cameras: BoolProperty(
         name="Import cameras",
         description="Load cameras and make them children of the corresponding bones",
@@ -61,28 +96,274 @@ class ImportSparkModel(bpy.types.Operator, ImportHelper):
         default=True,
     )
 
-    def execute(self, context):
-        from . import import_spark_model
+    def import_keywords(self):
+        from . spark_model import AnimationFilter
 
         keywords = self.as_keywords(ignore=("axis_forward",
                                             "axis_up",
                                             "filter_glob",
+                                            "filepath",
+                                            "files",
+                                            "directory",
+                                            "frame_start",
+                                            "frame_end",
+                                            "frame_step",
+                                            "sequence_names",
                                             ))
 
+        keywords["animation_filter"] = AnimationFilter(self.frame_start, self.frame_end, self.frame_step,
+                                                       [n.strip() for n in self.sequence_names.split(',') if n.strip()])
+
         keywords["global_matrix"] = axis_conversion(from_forward=self.axis_forward,
                                                     from_up=self.axis_up,
                                                     ).to_4x4()
+        return keywords
+
+
+class ImportSparkModel(bpy.types.Operator, ImportSparkModelOptions):
+    bl_idname = "import_scene.spark_model"
+    bl_label = "Import Spark Model"
+    bl_options = {'PRESET', 'UNDO'}
+
+    def execute(self, context):
+        from . import import_spark_model
+
+        return import_spark_model.load(context, self.filepath, **self.import_keywords())
+
+
+class ImportSparkModelBackground(bpy.types.Operator, ImportSparkModelOptions):
+    """Import Spark models without blocking the interface, parsing on a worker thread"""
+    bl_idname = "import_scene.spark_model_background"
+    bl_label = "Import Spark Model (Background)"
+    # every imported model pushes its own undo step, undoing a model that is still being built would free its data
+    bl_options = {'PRESET'}
+
+    files: CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+
+    # seconds of datablock building per timer event
+    slice_time = 0.02
+
+    # shared with CancelSparkModelImport and cancel_background_imports
+    running = []
+    cancel_requested = False
+
+    def execute(self, context):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._keywords = self.import_keywords()
+        self._animation_filter = self._keywords.pop("animation_filter")
+        self._filepaths = [os.path.join(self.directory, f.name) for f in self.files if f.name] or [self.filepath]
+        self._models_num = len(self._filepaths)
+
+        # at most one parsed model waits in memory: file N+1 is parsed while file N is being built
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._parsing = None
+        self._builder = None
+        self._filepath = None
+        self._datablocks = []
+        self.parse_next()
+
+        ImportSparkModelBackground.running.append(self)
+
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(0.01, window=context.window)
+        window_manager.modal_handler_add(self)
+        self.update_status(context)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        from time import perf_counter
+
+        if ImportSparkModelBackground.cancel_requested:
+            self.cancel(context)
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        # the build makes the armature active to create its bones, give the user their active object back
+        view_layer = context.view_layer
+        active = view_layer.objects.active
+        try:
+            finished = self.build(context, perf_counter() + self.slice_time)
+        finally:
+            view_layer.objects.active = active
+
+        if finished:
+            self.finish(context)
+            return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def build(self, context, deadline):
+        """Build models until the deadline, return whether every model is imported."""
+        from time import perf_counter
+        from . import import_spark_model
+
+        while perf_counter() < deadline:
+            if self._builder is None:
+                if self._parsing is None:
+                    return True
+
+                filepath, future = self._parsing
+                if not future.done():
+                    break
+                self.parse_next()
+                self.update_status(context)
+
+                try:
+                    chunks, animation_chunks = future.result()
+                except Exception as e:
+                    self.report({'ERROR'}, "%s: %s" % (filepath, e))
+                    continue
+
+                if chunks is None:
+                    self.report({'ERROR'}, "%s: invalid model format" % filepath)
+                    continue
+
+                self._filepath = filepath
+                self._datablocks = []
+                self._builder = import_spark_model.build_model(context, filepath, chunks, animation_chunks,
+                                                               self._datablocks, **self._keywords)
+
+            try:
+                step = next(self._builder)
+            except StopIteration:
+                self._builder = None
+                bpy.ops.ed.undo_push(message="Import Spark Model")
+            except Exception as e:
+                self.report({'ERROR'}, "%s: %s" % (self._filepath, e))
+                self._builder = None
+                import_spark_model.remove_datablocks(self._datablocks)
+            else:
+                if step == import_spark_model.WAIT_OBJECT_MODE:
+                    self.update_status(context, "waiting for Object mode")
+                    break
+
+        return False
+
+    def parse_next(self):
+        from . import import_spark_model
+
+        if not self._filepaths:
+            self._parsing = None
+            return
+
+        filepath = self._filepaths.pop(0)
+        self._parsing = (filepath, self._executor.submit(import_spark_model.parse_model, filepath,
+                                                         self._keywords["game_directory"],
+                                                         self._keywords["import_actions"],
+                                                         self._animation_filter))
+
+    def update_status(self, context, note=None):
+        done = self._models_num - len(self._filepaths) - (self._parsing is not None)
+        text = "Importing Spark models %d/%d, cancel from File > Import" % (done, self._models_num)
+        if note:
+            text += ", " + note
+        context.workspace.status_text_set(text)
+
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        context.workspace.status_text_set(None)
+        self._executor.shutdown(wait=False)
+        ImportSparkModelBackground.running.remove(self)
+        if not ImportSparkModelBackground.running:
+            ImportSparkModelBackground.cancel_requested = False
+
+    def stop(self):
+        """Drop the model being built and every file not imported yet."""
+        from . import import_spark_model
+
+        if self._builder is not None:
+            self._builder.close()
+            self._builder = None
+            import_spark_model.remove_datablocks(self._datablocks)
+
+        if self._parsing is not None:
+            self._parsing[1].cancel()
+            self._parsing = None
+        self._filepaths.clear()
+
+    def cancel(self, context):
+        self.stop()
+        self.finish(context)
+
+
+@persistent
+def cancel_background_imports(*args):
+    # undo, redo and loading a file free the datablocks running builds refer to, so remove them first
+    for op in ImportSparkModelBackground.running:
+        op.stop()
+    if ImportSparkModelBackground.running:
+        ImportSparkModelBackground.cancel_requested = True
+
 
-        return import_spark_model.load(context, **keywords)
+class CancelSparkModelImport(bpy.types.Operator):
+    """Cancel running background imports of Spark models, removing the model being built"""
+    bl_idname = "import_scene.spark_model_background_cancel"
+    bl_label = "Cancel Spark Model Import"
+
+    @classmethod
+    def poll(cls, context):
+        return bool(ImportSparkModelBackground.running)
+
+    def execute(self, context):
+        ImportSparkModelBackground.cancel_requested = True
+        return {'FINISHED'}
+
+
+class UpdateSparkModelCatalog(bpy.types.Operator):
+    """Scan a game directory and update the catalog of its Spark models"""
+    bl_idname = "import_scene.spark_model_update_catalog"
+    bl_label = "Update Spark Model Catalog"
+
+    game_directory: StringProperty(
+        name="Game directory",
+        description="For example C:/Steam/steamapps/common/Natural Selection 2/ns2",
+        maxlen=1024,
+    )
+
+    catalog_path: StringProperty(
+        name="Catalog",
+        description="SQLite catalog file, empty to keep it in the Blender configuration directory",
+        maxlen=1024,
+        subtype='FILE_PATH',
+    )
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        from . import catalog_spark_model
+
+        if not os.path.isdir(self.game_directory):
+            self.report({'ERROR'}, "Game directory not found")
+            return {'CANCELLED'}
+
+        catalog_path = self.catalog_path or os.path.join(bpy.utils.user_resource('CONFIG', create=True),
+                                                         "spark_model_catalog.sqlite")
+        # process pool workers would import the addon, which needs bpy, so scan in this process
+        scanned, removed = catalog_spark_model.update_catalog(catalog_path, self.game_directory, processes=1)
+
+        self.report({'INFO'}, "Scanned %d models, removed %d" % (scanned, removed))
+        return {'FINISHED'}
 
 
 def menu_func_import(self, context):
     self.layout.operator(ImportSparkModel.bl_idname,
                          text="Spark Model (.model)")
+    self.layout.operator(ImportSparkModelBackground.bl_idname,
+                         text="Spark Model, Background (.model)")
+    if ImportSparkModelBackground.running:
+        self.layout.operator(CancelSparkModelImport.bl_idname,
+                             text="Cancel Spark Model Import")
 
 
 classes = (
     ImportSparkModel,
+    ImportSparkModelBackground,
+    CancelSparkModelImport,
+    UpdateSparkModelCatalog,
 )
 
 
@@ -92,8 +373,14 @@ def register():
 
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
 
+    for handlers in (bpy.app.handlers.undo_pre, bpy.app.handlers.redo_pre, bpy.app.handlers.load_pre):
+        handlers.append(cancel_background_imports)
+
 
 def unregister():
+    for handlers in (bpy.app.handlers.undo_pre, bpy.app.handlers.redo_pre, bpy.app.handlers.load_pre):
+        handlers.remove(cancel_background_imports)
+
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
 
     for cls in classes:
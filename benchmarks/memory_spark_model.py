@@ -0,0 +1,75 @@
+"""Measure memory of parsed Spark models.
+
+Parses every .model under a directory with spark_model and keeps all chunks alive,
+like a long batch session does, then reports retained and peak traced memory.
+Run it against two checkouts to compare record layouts:
+
+    python benchmarks/memory_spark_model.py "C:/Steam/steamapps/common/Natural Selection 2/ns2"
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from spark_model import MODEL_MAGIC, ErrorChunkEOF, ErrorUnknownChunk, read_chunk
+
+
+def read_model(filepath):
+    chunks = {}
+    with open(filepath, 'rb') as fd:
+        if fd.read(4) != MODEL_MAGIC:
+            return None
+        while True:
+            try:
+                chunk = read_chunk(fd)
+                chunks[type(chunk)] = chunk
+            except ErrorUnknownChunk:
+                pass
+            except ErrorChunkEOF:
+                return chunks
+
+
+def find_models(directory):
+    for root, _, files in os.walk(directory):
+        for f in sorted(files):
+            if f.lower().endswith('.model'):
+                yield os.path.join(root, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("-n", "--limit", type=int, default=0, help="parse at most N models")
+    args = parser.parse_args()
+
+    filepaths = list(find_models(args.directory))
+    if args.limit:
+        filepaths = filepaths[:args.limit]
+
+    models, failed = [], 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for filepath in filepaths:
+        try:
+            chunks = read_model(filepath)
+        except Exception:
+            chunks = None
+        if chunks is None:
+            failed += 1
+        else:
+            models.append(chunks)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("models:   %d parsed, %d failed" % (len(models), failed))
+    print("time:     %.2f s" % elapsed)
+    print("retained: %.1f MiB" % (retained / 1024 ** 2))
+    print("peak:     %.1f MiB" % (peak / 1024 ** 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sqlite3
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import path
+
+try:
+    from . spark_model import *
+except ImportError:
+    # run as a script, so process pool workers never import the addon and bpy
+    from spark_model import *
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS models (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    vertices_num INTEGER,
+    triangles_num INTEGER,
+    face_sets_num INTEGER,
+    bones_num INTEGER,
+    skeleton TEXT,
+    animations_num INTEGER,
+    frames_num INTEGER,
+    animation_model TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    model TEXT NOT NULL REFERENCES models(path) ON DELETE CASCADE,
+    chunk_id INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    model TEXT NOT NULL REFERENCES models(path) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    model TEXT NOT NULL REFERENCES models(path) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS models_skeleton ON models(skeleton);
+CREATE INDEX IF NOT EXISTS models_animation_model ON models(animation_model);
+CREATE INDEX IF NOT EXISTS chunks_model ON chunks(model);
+CREATE INDEX IF NOT EXISTS sequences_model ON sequences(model);
+CREATE INDEX IF NOT EXISTS dependencies_model ON dependencies(model);
+CREATE INDEX IF NOT EXISTS dependencies_path ON dependencies(path);
+'''
+
+
+def normalize_path(p):
+    return p.replace('\\', '/')
+
+
+def skeleton_signature(bone_names, bone_parents):
+    if not bone_names:
+        return None
+    h = hashlib.sha1()
+    for name, parent in zip(bone_names, bone_parents):
+        h.update(('%s\0%d\n' % (name, parent)).encode())
+    return h.hexdigest()
+
+
+def find_models(game_directory):
+    models = {}
+    for root, _, files in os.walk(game_directory):
+        for f in files:
+            if not f.lower().endswith('.model'):
+                continue
+            filepath = path.join(root, f)
+            st = os.stat(filepath)
+            models[normalize_path(path.relpath(filepath, game_directory))] = (st.st_size, st.st_mtime_ns)
+    return models
+
+
+def scan_model(game_directory, model_path, size, mtime):
+    record = {
+        'path': model_path,
+        'size': size,
+        'mtime': mtime,
+        'chunks': [],
+        'sequences': [],
+        'dependencies': [],
+    }
+
+    try:
+        with open(path.join(game_directory, model_path), 'rb') as fd:
+            info = probe_model(fd)
+    except Exception as e:
+        record['error'] = str(e) or type(e).__name__
+        return record
+
+    record['vertices_num'] = info.vertices_num
+    record['triangles_num'] = info.triangles_num
+    record['face_sets_num'] = info.face_sets_num
+    record['bones_num'] = len(info.bone_names)
+    record['skeleton'] = skeleton_signature(info.bone_names, info.bone_parents)
+    record['animations_num'] = info.animations_num
+    record['frames_num'] = sum(info.frames_nums)
+    record['chunks'] = info.chunks
+    record['sequences'] = info.sequence_names
+
+    if info.animation_model:
+        record['animation_model'] = normalize_path(info.animation_model)
+        record['dependencies'].append(('animation_model', record['animation_model']))
+
+    for mn in info.material_names:
+        mn = normalize_path(mn)
+        record['dependencies'].append(('material', mn))
+
+        mat_path = path.join(game_directory, mn)
+        if not path.exists(mat_path):
+            continue
+        with open(mat_path, 'r', errors='replace') as fd:
+            mat_params = read_material_params(fd)
+        for key, val in mat_params.items():
+            if key.endswith('Map') and val:
+                record['dependencies'].append(('texture', normalize_path(val)))
+
+    return record
+
+
+def store_model(db, record):
+    db.execute('DELETE FROM models WHERE path = ?', (record['path'],))
+    db.execute('INSERT INTO models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+        record['path'],
+        record['size'],
+        record['mtime'],
+        record.get('vertices_num'),
+        record.get('triangles_num'),
+        record.get('face_sets_num'),
+        record.get('bones_num'),
+        record.get('skeleton'),
+        record.get('animations_num'),
+        record.get('frames_num'),
+        record.get('animation_model'),
+        record.get('error'),
+    ))
+    db.executemany('INSERT INTO chunks VALUES (?, ?, ?)',
+                   ((record['path'], chunk_id, length) for chunk_id, length in record['chunks']))
+    db.executemany('INSERT INTO sequences VALUES (?, ?)',
+                   ((record['path'], name) for name in record['sequences']))
+    db.executemany('INSERT INTO dependencies VALUES (?, ?, ?)',
+                   ((record['path'], kind, p) for kind, p in record['dependencies']))
+
+
+def open_catalog(catalog_path):
+    db = sqlite3.connect(catalog_path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def update_catalog(catalog_path, game_directory, processes=None):
+    """Scan models under game_directory whose size or mtime changed since the last update.
+
+    Returns the numbers of scanned and removed models.
+    """
+    models = find_models(game_directory)
+
+    db = open_catalog(catalog_path)
+    try:
+        known = {p: (size, mtime) for p, size, mtime in db.execute('SELECT path, size, mtime FROM models')}
+        removed = [p for p in known if p not in models]
+        changed = [(p, size, mtime) for p, (size, mtime) in models.items() if known.get(p) != (size, mtime)]
+
+        if processes == 1 or len(changed) < 2:
+            records = [scan_model(game_directory, *m) for m in changed]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                records = list(executor.map(partial(scan_model, game_directory), *zip(*changed), chunksize=64))
+
+        with db:
+            db.executemany('DELETE FROM models WHERE path = ?', ((p,) for p in removed))
+            for record in records:
+                store_model(db, record)
+    finally:
+        db.close()
+
+    return len(changed), len(removed)
+
+
+def models_with_skeleton(catalog_path, model_path):
+    """Models whose bone names and hierarchy match those of model_path."""
+    db = open_catalog(catalog_path)
+    try:
+        return [p for p, in db.execute(
+            'SELECT path FROM models WHERE skeleton = (SELECT skeleton FROM models WHERE path = ?) AND path != ?',
+            (normalize_path(model_path), normalize_path(model_path)))]
+    finally:
+        db.close()
+
+
+def models_using_animation_model(catalog_path, animation_model_path):
+    db = open_catalog(catalog_path)
+    try:
+        return [p for p, in db.execute('SELECT path FROM models WHERE animation_model = ?',
+                                       (normalize_path(animation_model_path),))]
+    finally:
+        db.close()
+
+
+def model_dependencies(catalog_path, model_path):
+    """Return (kind, path) of the materials, textures and animation model used by model_path."""
+    db = open_catalog(catalog_path)
+    try:
+        return list(db.execute('SELECT kind, path FROM dependencies WHERE model = ?', (normalize_path(model_path),)))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Update the catalog of Spark models in a game directory")
+    parser.add_argument("game_directory")
+    parser.add_argument("catalog")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of processes to scan models with, one per CPU by default")
+    args = parser.parse_args()
+
+    print("Scanned %d models, removed %d" % update_catalog(args.catalog, args.game_directory, args.processes))
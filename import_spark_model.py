@@ -1,13 +1,18 @@
 import bpy
+import numpy as np
 
 from bpy_extras import node_shader_utils
 from bpy_extras.image_utils import load_image
 from os import path
 
+from mathutils import Matrix
 from . spark_model import *
 
 POSEDATA_PREFIX = 'pose.bones["%s"].'
 
+# yielded by build_model while it waits for the user to leave Edit, Pose or any other mode
+WAIT_OBJECT_MODE = 'WAIT_OBJECT_MODE'
+
 
 def invalid_model_format(self, context):
     self.layout.label(text='Invalid model format')
@@ -17,6 +22,188 @@ def invalid_animation_model(self, context):
     self.layout.label(text='Invalid external animation model')
 
 
+def missing_sequences(names):
+    def draw(self, context):
+        self.layout.label(text='Sequences not found: %s' % ', '.join(sorted(names)))
+    return draw
+
+
+def palette_conflicts(count):
+    def draw(self, context):
+        self.layout.label(text='%d vertices are shared by face sets with different bones, '
+                               'they were split to keep their weights' % count)
+    return draw
+
+
+def dropped_faces(count):
+    def draw(self, context):
+        self.layout.label(text='%d collapsed or repeated triangles were not imported' % count)
+    return draw
+
+
+def affine_parts_to_matrices(affine_parts):
+    data = np.array([ap.data[:10] for ap in affine_parts], dtype=np.float64).reshape(-1, 10)
+    x, y, z, w = data[:, 3], data[:, 4], data[:, 5], data[:, 6]
+
+    # translation @ scale @ rotation, flip only negates the quaternion
+    mats = np.zeros((len(data), 4, 4))
+    mats[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    mats[:, 0, 1] = 2.0 * (x * y - w * z)
+    mats[:, 0, 2] = 2.0 * (x * z + w * y)
+    mats[:, 1, 0] = 2.0 * (x * y + w * z)
+    mats[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    mats[:, 1, 2] = 2.0 * (y * z - w * x)
+    mats[:, 2, 0] = 2.0 * (x * z - w * y)
+    mats[:, 2, 1] = 2.0 * (y * z + w * x)
+    mats[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    mats[:, :3, :3] *= data[:, 7:10, np.newaxis]
+    mats[:, :3, 3] = data[:, 0:3]
+    mats[:, 3, 3] = 1.0
+
+    return mats
+
+
+def edit_bone_axes(mats):
+    """Orthonormalize 3x3 matrices like setting EditBone.matrix does:
+    keep the Y axis and take the roll from the Z axis projected onto the plane normal to Y."""
+    y = mats[:, :, 1] / np.linalg.norm(mats[:, :, 1], axis=1)[:, np.newaxis]
+    z = mats[:, :, 2] - np.einsum('ij,ij->i', mats[:, :, 2], y)[:, np.newaxis] * y
+    z /= np.linalg.norm(z, axis=1)[:, np.newaxis]
+    x = np.cross(y, z)
+    return np.stack((x, y, z), axis=2)
+
+
+def bone_world_matrices(bones):
+    local = affine_parts_to_matrices([b.affine_parts for b in bones])
+    parents = np.array([b.parent for b in bones], dtype=np.int64)
+
+    depths = np.full(len(bones), -1, dtype=np.int64)
+    for i in range(len(bones)):
+        chain = []
+        while i > -1 and depths[i] < 0:
+            # a bone that is its own ancestor would never reach a root
+            if len(chain) == len(bones):
+                raise ErrorInvalidModel
+            chain.append(i)
+            i = parents[i]
+        depth = depths[i] if i > -1 else -1
+        for c in reversed(chain):
+            depth += 1
+            depths[c] = depth
+
+    # edit bones only keep their Y axis and roll, so every level is composed with what the parent edit bone reads back
+    world = np.empty_like(local)
+    for depth in range(depths.max() + 1 if len(bones) else 0):
+        idx = np.flatnonzero(depths == depth)
+        if depth == 0:
+            world[idx] = local[idx]
+        else:
+            world[idx] = world[parents[idx]] @ local[idx]
+        world[idx, :3, :3] = edit_bone_axes(world[idx, :3, :3])
+
+    return world
+
+
+def bone_rest_matrices(bones, world):
+    parents = np.array([b.parent for b in bones], dtype=np.int64)
+    rest = world.copy()
+    has_parent = parents > -1
+    rest[has_parent] = np.linalg.inv(world[parents[has_parent]]) @ world[has_parent]
+    return rest
+
+
+def face_set_indices(chunk_face_sets, faces_num):
+    indices = np.full(faces_num, -1, dtype=np.int64)
+    for i, fc in enumerate(chunk_face_sets.face_sets):
+        indices[fc.first_face:fc.first_face + fc.faces_num] = i
+    return indices
+
+
+def vertex_skin(chunk_vertices, chunk_face_sets, faces, face_sets):
+    """Resolve skin weights to armature bones, splitting vertices whose bones differ between face sets.
+
+    Returns source vertex of every resulting vertex, remapped faces, weights, bones and the number of split vertices.
+    """
+    vertices_num = len(chunk_vertices.vertices)
+    palettes_num = max((len(fc.bones) for fc in chunk_face_sets.face_sets), default=0)
+
+    # -1 pads shorter palettes
+    palettes = np.full((len(chunk_face_sets.face_sets), max(palettes_num, 1)), -1, dtype=np.int64)
+    for i, fc in enumerate(chunk_face_sets.face_sets):
+        palettes[i, :len(fc.bones)] = fc.bones
+
+    bone_weights = np.array([v.bone_weights for v in chunk_vertices.vertices], dtype=np.float64).reshape(-1, 8)
+    weights = bone_weights[:, ::2].astype(np.float32)
+    local_bones = np.clip(bone_weights[:, 1::2].astype(np.int64), 0, palettes.shape[1] - 1)
+
+    # armature bones of every face set corner, -1 for unused weights
+    in_face_set = np.repeat(face_sets > -1, 3)
+    corners = faces.reshape(-1)[in_face_set]
+    corner_face_sets = np.repeat(face_sets, 3)[in_face_set]
+    corner_bones = palettes[corner_face_sets[:, np.newaxis], local_bones[corners]]
+    corner_bones[(weights[corners] <= 0.0) | (corner_bones < 0)] = -1
+
+    # one vertex per used (vertex, bones) pair, palettes sharing boundary bones keep the vertex whole,
+    # the first pair of a vertex keeps its index and every other one gets a copy after the original vertices
+    pairs, pair_first, corner_pairs = np.unique(np.column_stack((corners, corner_bones)), axis=0,
+                                                return_index=True, return_inverse=True)
+    pair_vertices = pairs[:, 0]
+    copies = np.zeros(len(pairs), dtype=bool)
+    copies[1:] = pair_vertices[1:] == pair_vertices[:-1]
+    conflicts = len(np.unique(pair_vertices[copies]))
+
+    pair_indices = pair_vertices.copy()
+    pair_indices[copies] = vertices_num + np.arange(np.count_nonzero(copies))
+    vert_sources = np.concatenate((np.arange(vertices_num), pair_vertices[copies]))
+
+    faces = faces.copy().reshape(-1)
+    faces[in_face_set] = pair_indices[corner_pairs.reshape(-1)]
+    faces = faces.reshape(-1, 3)
+
+    # vertices outside every face set have no bones
+    bones = np.full((len(vert_sources), 4), -1, dtype=np.int64)
+    bones[pair_indices] = corner_bones[pair_first]
+    weights = weights[vert_sources]
+    weights[bones < 0] = 0.0
+
+    return vert_sources, faces, weights, bones, conflicts
+
+
+def weld(co, weights, bones, faces):
+    """Merge vertices with equal position and skin, except those of triangles welding would collapse
+    or merge with another triangle, which keep copies of their original vertices.
+
+    Returns the indices of vertices to create and the welded faces.
+    """
+    key = np.concatenate((co, weights, bones), axis=1)
+    _, first, inverse = np.unique(key, axis=0, return_index=True, return_inverse=True)
+
+    # keep the original order of first occurrences
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    vert_indices = first[order]
+    welded = remap[inverse.reshape(-1)][faces]
+
+    # double sided geometry welds into pairs with the same corners and opposite winding
+    merged = ~valid_faces_mask(welded) & valid_faces_mask(faces)
+    sources, copies = np.unique(faces[merged], return_inverse=True)
+    welded[merged] = len(vert_indices) + copies.reshape(-1, 3)
+
+    return np.concatenate((vert_indices, sources)), welded
+
+
+def valid_faces_mask(faces):
+    """Return which triangles can be created: not collapsed and not repeating another triangle."""
+    mask = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    unique = np.zeros(len(faces), dtype=bool)
+    unique[first] = True
+
+    return mask & unique
+
+
 def set_keyframe(curves, frame, values):
     for i, c in enumerate(curves):
         c.keyframe_points.add(1)
@@ -24,7 +211,7 @@ def set_keyframe(curves, frame, values):
         c.keyframe_points[-1].interpolation = 'LINEAR'
 
 
-def create_actions(context, arm_obj, chunks):
+def create_actions(scene, arm_obj, chunks, rest_matrices, datablocks):
     chunk_bones = chunks.get(ChunkBones)
     chunk_animations = chunks.get(ChunkAnimations)
     chunk_animation_nodes = chunks.get(ChunkAnimationNodes)
@@ -38,15 +225,17 @@ def create_actions(context, arm_obj, chunks):
     if not animation_data:
         animation_data = arm_obj.animation_data_create()
 
-    context.view_layer.objects.active = arm_obj
-    bpy.ops.object.mode_set(mode='POSE')
     actions = []
 
     for a in chunk_animations.animations:
+        if a is None:
+            actions.append(None)
+            continue
+
         act = bpy.data.actions.new('action')
+        datablocks.append(act)
 
-        curves_loc, curves_rot, curves_scale = {}, {}, {}
-        for b in a.keys:
+        for b, vals in a.keys.items():
             bone_name = chunk_bones.bones[b].name
             g = act.groups.new(name=bone_name)
             cl = [act.fcurves.new(data_path=(POSEDATA_PREFIX % bone_name) + 'location', index=i) for i in range(3)]
@@ -60,32 +249,23 @@ def create_actions(context, arm_obj, chunks):
             for c in cs:
                 c.group = g
 
-            curves_loc[b] = cl
-            curves_rot[b] = cr
-            curves_scale[b] = cs
-
             arm_obj.pose.bones[bone_name].rotation_mode = 'QUATERNION'
 
-        frames_num = len(list(a.keys.values())[0])
-        for f in range(frames_num):
-            for b, vals in a.keys.items():
-                bone = arm_obj.pose.bones[chunk_bones.bones[b].name]
-
-                mat = vals[f].to_mat4x4()
-                if bone.parent:
-                    mat = bone.parent.matrix @ mat
-                bone.matrix = mat
-
-                set_keyframe(curves_loc[b], f, bone.location)
-                set_keyframe(curves_rot[b], f, bone.rotation_quaternion)
-                set_keyframe(curves_scale[b], f, bone.scale)
+            # pose matrix is parent pose @ rest @ basis, so the basis only depends on the bone's own keys
+            basis = np.linalg.inv(rest_matrices[bone_name]) @ affine_parts_to_matrices(vals)
+            for f, frame in enumerate(a.frames):
+                loc, rot, scale = Matrix(basis[f].tolist()).decompose()
+                set_keyframe(cl, frame, loc)
+                set_keyframe(cr, frame, rot)
+                set_keyframe(cs, frame, scale)
+            yield
 
         animation_data.action = act
-        context.scene.frame_start = 0
-        context.scene.frame_end = frames_num
+        if a.frames:
+            scene.frame_start = a.frames[0]
+            scene.frame_end = a.frames[-1] + 1
         actions.append(act)
-
-    bpy.ops.object.mode_set(mode='OBJECT')
+        yield
 
     if not chunk_sequences:
         return
@@ -93,7 +273,8 @@ def create_actions(context, arm_obj, chunks):
     for s in chunk_sequences.sequences:
         an = chunk_animation_nodes.animation_nodes[s.animation_node]
         if an.node_type == NodeType.ANIMATION:
-            actions[an.data.animation].name = s.name
+            if actions[an.data.animation]:
+                actions[an.data.animation].name = s.name
         elif an.node_type == NodeType.BLEND:
             pass
         else:
@@ -137,7 +318,7 @@ def create_attach_points(collection, arm_obj, chunks):
         collection.objects.link(point_obj)
 
 
-def create_iamge(img_path):
+def create_iamge(img_path, datablocks):
     img_name = path.basename(img_path)
 
     img = bpy.data.images.get(img_name)
@@ -147,34 +328,32 @@ def create_iamge(img_path):
     if not path.exists(img_path):
         return None
 
-    return load_image(img_path)
+    img = load_image(img_path)
+    if img:
+        datablocks.append(img)
+    return img
 
 
-def create_materials(mesh, chunk_materials, game_directory):
+def create_materials(mesh, chunk_materials, game_directory, datablocks):
     for mn in chunk_materials.material_names:
         mat_name = path.basename(mn)
         mat = bpy.data.materials.get(mat_name)
         if not mat:
             mat = bpy.data.materials.new(name=mat_name)
+            datablocks.append(mat)
             mat_path = path.join(game_directory, mn)
 
             if not path.exists(mat_path):
                 continue
 
-            mat_params = {}
             with open(mat_path, 'r') as fd:
-                for line in fd:
-                    splited = line.split('=')
-                    if len(splited) != 2:
-                        continue
-                    key, val = map(lambda s: s.strip().replace('"', ''), splited)
-                    mat_params[key] = val
+                mat_params = read_material_params(fd)
 
             mat_wrap = node_shader_utils.PrincipledBSDFWrapper(mat, is_readonly=False)
 
             if 'albedoMap' in mat_params:
                 img_path = path.join(game_directory, mat_params['albedoMap'])
-                img = create_iamge(img_path)
+                img = create_iamge(img_path, datablocks)
                 if img:
                     nodetex = mat_wrap.base_color_texture
                     nodetex.image = img
@@ -182,48 +361,86 @@ def create_materials(mesh, chunk_materials, game_directory):
 
             if 'normalMap' in mat_params:
                 img_path = path.join(game_directory, mat_params['normalMap'])
-                img = create_iamge(img_path)
+                img = create_iamge(img_path, datablocks)
                 if img:
                     mat_wrap.normalmap_texture.image = img
 
             if 'specularMap' in mat_params:
                 img_path = path.join(game_directory, mat_params['specularMap'])
-                img = create_iamge(img_path)
+                img = create_iamge(img_path, datablocks)
                 if img:
                     mat_wrap.specular_texture.image = img
 
             if 'emissiveMap' in mat_params:
                 img_path = path.join(game_directory, mat_params['emissiveMap'])
-                img = create_iamge(img_path)
+                img = create_iamge(img_path, datablocks)
                 if img:
                     mat_wrap.emission_color_texture.image = img
 
         mesh.materials.append(mat)
 
 
-def read_all_chunks(fd):
+def read_all_chunks(fd, animation_filter=None):
+    animations, missing = None, None
+    if animation_filter and animation_filter.sequence_names:
+        offset = fd.tell()
+        chunks = read_chunks(fd, (ChunkAnimationNodes, ChunkSequences))
+        animations, missing = animation_filter.sequence_animations(chunks.get(ChunkSequences),
+                                                                   chunks.get(ChunkAnimationNodes))
+        fd.seek(offset)
+
     chunks = {}
     while True:
         try:
-            chunk = read_chunk(fd)
+            chunk = read_chunk(fd, animation_filter, animations)
             chunks[type(chunk)] = chunk
         except ErrorUnknownChunk as e:
             print(e) # TODO: remove
         except ErrorChunkEOF:
             break
+
+    if ChunkAnimations in chunks:
+        chunks[ChunkAnimations].missing_sequences = missing
     return chunks
 
 
-def load(context, filepath, *, game_directory, import_actions, import_cameras, import_attach_points, global_matrix):
+def read_model(filepath, animation_filter=None):
+    with open(filepath, 'rb') as fd:
+        if fd.read(4) != MODEL_MAGIC:
+            return None
+        return read_all_chunks(fd, animation_filter)
+
+
+def parse_model(filepath, game_directory, import_actions, animation_filter=None):
+    """Read the model and its external animation model without touching bpy data.
+
+    Safe to call from a worker thread, returns chunks for build_model.
+    """
+    chunks = read_model(filepath, animation_filter)
+    animation_chunks = None
+
+    if chunks and import_actions:
+        chunk_animation_model = chunks.get(ChunkAnimationModel)
+        if chunk_animation_model and path.exists(game_directory):
+            external_model_path = path.join(game_directory, chunk_animation_model.path)
+            if path.exists(external_model_path):
+                animation_chunks = read_model(external_model_path, animation_filter)
+
+    return chunks, animation_chunks
+
+
+def build_model(context, filepath, chunks, animation_chunks, datablocks, *, game_directory, weld_vertices,
+                import_actions, import_cameras, import_attach_points, global_matrix):
+    """Create datablocks from parsed chunks, yielding between steps so the build can be sliced.
+
+    Every datablock created before a yield is appended to datablocks, so a cancelled build can be removed.
+    Yields WAIT_OBJECT_MODE until the user is in Object mode, as edit bones can only be created in Edit mode.
+    """
     view_layer = context.view_layer
+    scene = context.scene
+    window_manager = context.window_manager
     collection = view_layer.active_layer_collection.collection
 
-    with open(filepath, 'rb') as fd:
-        if fd.read(4) != b'MDL\x07':
-            context.window_manager.popup_menu(invalid_model_format, title='Error', icon='ERROR')
-            return {'CANCELLED'}
-        chunks = read_all_chunks(fd)
-
     chunk_vertices = chunks.get(ChunkVertices)
     chunk_indices = chunks.get(ChunkIndices)
     chunk_face_sets = chunks.get(ChunkFaceSets)
@@ -231,84 +448,117 @@ def load(context, filepath, *, game_directory, import_actions, import_cameras, i
     chunk_materials = chunks.get(ChunkMaterials)
     chunk_animation_model = chunks.get(ChunkAnimationModel)
 
-    vertices = [v.co for v in chunk_vertices.vertices]
-    faces = [i for i in chunk_indices.indices]
-    normals = [v.nrm for v in chunk_vertices.vertices]
-    uvs = [(v.uv[0], 1.0 - v.uv[1]) for v in chunk_vertices.vertices]
+    co = np.array([v.co for v in chunk_vertices.vertices], dtype=np.float32).reshape(-1, 3)
+    normals = np.array([v.nrm for v in chunk_vertices.vertices], dtype=np.float32).reshape(-1, 3)
+    uvs = np.array([(v.uv[0], 1.0 - v.uv[1]) for v in chunk_vertices.vertices], dtype=np.float32).reshape(-1, 2)
+    faces = np.array(chunk_indices.indices, dtype=np.int64).reshape(-1, 3)
+    face_sets = face_set_indices(chunk_face_sets, len(faces))
+
+    # normals and uvs are written per loop, so welding seams does not change shading or texturing
+    loop_normals = normals[faces].reshape(-1, 3)
+    loop_uvs = uvs[faces].reshape(-1, 2)
+
+    vert_sources, faces, weights, weight_bones, conflicts = vertex_skin(chunk_vertices, chunk_face_sets, faces,
+                                                                        face_sets)
+    co = co[vert_sources]
+    if conflicts:
+        window_manager.popup_menu(palette_conflicts(conflicts), title='Warning', icon='ERROR')
+
+    if weld_vertices:
+        vert_indices, faces = weld(co, weights, weight_bones, faces)
+
+        # only triangles collapsed or repeated in the model itself are left invalid
+        valid = valid_faces_mask(faces)
+        faces = faces[valid]
+        face_sets = face_sets[valid]
+        loop_normals = loop_normals[np.repeat(valid, 3)]
+        loop_uvs = loop_uvs[np.repeat(valid, 3)]
+        if not valid.all():
+            window_manager.popup_menu(dropped_faces(np.count_nonzero(~valid)), title='Warning', icon='ERROR')
+    else:
+        vert_indices = np.arange(len(co))
 
     mesh = bpy.data.meshes.new('mesh')
-    mesh.from_pydata(vertices, [], faces)
-    mesh.normals_split_custom_set_from_vertices(normals)
+    datablocks.append(mesh)
+    mesh.from_pydata(co[vert_indices].tolist(), [], faces.tolist())
+    mesh.normals_split_custom_set(loop_normals.tolist())
     mesh.use_auto_smooth = True
+    yield
 
-    create_materials(mesh, chunk_materials, game_directory)
+    create_materials(mesh, chunk_materials, game_directory, datablocks)
+    yield
 
     uv_layer = mesh.uv_layers.new()
-    for f, face in enumerate(mesh.polygons):
-        for i, loop in enumerate(face.loop_indices):
-            uv_layer.data[loop].uv = uvs[faces[f][i]]
+    uv_layer.data.foreach_set('uv', loop_uvs.reshape(-1))
 
     arm = bpy.data.armatures.new('arm')
     arm_obj = bpy.data.objects.new(path.basename(filepath), arm)
+    datablocks.extend((arm, arm_obj))
     arm_obj.show_in_front = True
     arm_obj.matrix_world = global_matrix
 
     mesh_obj = bpy.data.objects.new('model', mesh)
+    datablocks.append(mesh_obj)
     mesh_obj.parent = arm_obj
     modifier = mesh_obj.modifiers.new(type='ARMATURE', name='Armature')
     modifier.object = arm_obj
 
-    vert2face = {}
-    for i, fc in enumerate(chunk_face_sets.face_sets):
-        for f in range(fc.first_face, fc.first_face + fc.faces_num):
-            mesh.polygons[f].material_index = fc.mat_index
-            vert2face[faces[f][0]] = i
-            vert2face[faces[f][1]] = i
-            vert2face[faces[f][2]] = i
-
-    vert_groups = [mesh_obj.vertex_groups.new(name=b.name) for b in chunk_bones.bones]
-    for i, v in enumerate(chunk_vertices.vertices):
-        face = vert2face[i]
-        bones = chunk_face_sets.face_sets[face].bones
-        for weight, bone in zip(v.bone_weights[::2], v.bone_weights[1::2]):
-            if weight > 0.0:
-                vert_groups[bones[bone]].add([i], weight, 'REPLACE')
+    mat_indices = np.array([fc.mat_index for fc in chunk_face_sets.face_sets] + [0], dtype=np.int32)
+    mesh.polygons.foreach_set('material_index', mat_indices[face_sets])
 
     collection.objects.link(mesh_obj)
     collection.objects.link(arm_obj)
 
+    vert_groups = [mesh_obj.vertex_groups.new(name=b.name) for b in chunk_bones.bones]
+    for i, v in enumerate(vert_indices):
+        for weight, bone in zip(weights[v].tolist(), weight_bones[v].tolist()):
+            if bone > -1:
+                vert_groups[bone].add([i], weight, 'REPLACE')
+        if i % 1024 == 1023:
+            yield
+    yield
+
+    world_matrices = bone_world_matrices(chunk_bones.bones)
+    rest_matrices = dict(zip((b.name for b in chunk_bones.bones),
+                             bone_rest_matrices(chunk_bones.bones, world_matrices)))
+
+    while context.mode != 'OBJECT':
+        yield WAIT_OBJECT_MODE
+
     view_layer.objects.active = arm_obj
     bpy.ops.object.mode_set(mode='EDIT')
 
     bones = []
-    for i, b in enumerate(chunk_bones.bones):
+    for b in chunk_bones.bones:
         bone = arm.edit_bones.new(b.name)
         bone.head = (0, 0, 0)
         bone.tail = (0, 0, 0.1)
+        bones.append(bone)
 
-        mat = b.affine_parts.to_mat4x4()
+    for b, bone, mat in zip(chunk_bones.bones, bones, world_matrices):
         if b.parent > -1:
             bone.parent = bones[b.parent]
-            mat = bones[b.parent].matrix @ mat
-
-        bone.matrix = mat
-        bones.append(bone)
+        bone.matrix = Matrix(mat.tolist())
 
     bpy.ops.object.mode_set(mode='OBJECT')
+    yield
 
     if import_actions:
-        create_actions(context, arm_obj, chunks)
+        yield from create_actions(scene, arm_obj, chunks, rest_matrices, datablocks)
 
         if chunk_animation_model and path.exists(game_directory):
-            success = False
-            external_model_path = path.join(game_directory, chunk_animation_model.path)
-            if path.exists(external_model_path):
-                with open(external_model_path, 'rb') as fd:
-                    if fd.read(4) == b'MDL\x07':
-                        create_actions(context, arm_obj, read_all_chunks(fd))
-                        success = True
-            if not success:
-                context.window_manager.popup_menu(invalid_animation_model, title='Warning', icon='ERROR')
+            if animation_chunks:
+                yield from create_actions(scene, arm_obj, animation_chunks, rest_matrices, datablocks)
+            else:
+                window_manager.popup_menu(invalid_animation_model, title='Warning', icon='ERROR')
+
+        # a sequence may live in either the model or its animation model
+        missing = [c.missing_sequences for c in (chunks.get(ChunkAnimations),
+                                                 animation_chunks and animation_chunks.get(ChunkAnimations))
+                   if c and c.missing_sequences is not None]
+        missing = set.intersection(*missing) if missing else None
+        if missing:
+            window_manager.popup_menu(missing_sequences(missing), title='Warning', icon='ERROR')
 
     if import_cameras:
         create_cameras(collection, arm_obj, chunks)
@@ -316,4 +566,51 @@ def load(context, filepath, *, game_directory, import_actions, import_cameras, i
     if import_attach_points:
         create_attach_points(collection, arm_obj, chunks)
 
+
+def remove_datablocks(datablocks):
+    collections = (
+        (bpy.types.Object, bpy.data.objects),
+        (bpy.types.Mesh, bpy.data.meshes),
+        (bpy.types.Armature, bpy.data.armatures),
+        (bpy.types.Material, bpy.data.materials),
+        (bpy.types.Image, bpy.data.images),
+        (bpy.types.Action, bpy.data.actions),
+    )
+
+    # objects were created after their data, so removing in reverse frees users first
+    for datablock in reversed(datablocks):
+        for cls, collection in collections:
+            try:
+                if isinstance(datablock, cls):
+                    collection.remove(datablock)
+                    break
+            except ReferenceError:
+                # already removed by the user while the build was running
+                break
+    datablocks.clear()
+
+
+def load(context, filepath, *, game_directory, weld_vertices, import_actions, import_cameras, import_attach_points,
+         animation_filter, global_matrix):
+    chunks, animation_chunks = parse_model(filepath, game_directory, import_actions, animation_filter)
+    if chunks is None:
+        context.window_manager.popup_menu(invalid_model_format, title='Error', icon='ERROR')
+        return {'CANCELLED'}
+
+    datablocks = []
+    try:
+        for step in build_model(context, filepath, chunks, animation_chunks, datablocks,
+                                game_directory=game_directory,
+                                weld_vertices=weld_vertices,
+                                import_actions=import_actions,
+                                import_cameras=import_cameras,
+                                import_attach_points=import_attach_points,
+                                global_matrix=global_matrix):
+            if step == WAIT_OBJECT_MODE:
+                bpy.ops.object.mode_set(mode='OBJECT')
+    except ErrorInvalidModel:
+        remove_datablocks(datablocks)
+        context.window_manager.popup_menu(invalid_model_format, title='Error', icon='ERROR')
+        return {'CANCELLED'}
+
     return {'FINISHED'}
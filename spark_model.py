@@ -1,15 +1,35 @@
+from array import array
 from enum import Enum
-from mathutils import Matrix, Quaternion
-from os import SEEK_CUR
+from os import SEEK_CUR, SEEK_END
 from struct import unpack
+from sys import intern
+
+MODEL_MAGIC = b'MDL\x07'
 
 
 def read_string(fd):
+    # names and paths repeat across models, share one copy of each
     length = unpack('<I', fd.read(4))[0]
-    return fd.read(length).decode()
+    return intern(fd.read(length).decode())
+
+
+def read_material_params(fd):
+    params = {}
+    for line in fd:
+        splited = line.split('=')
+        if len(splited) != 2:
+            continue
+        key, val = map(lambda s: s.strip().replace('"', ''), splited)
+        params[key] = val
+    return params
 
 
-def read_chunk(fd):
+def skip_string(fd):
+    length = unpack('<I', fd.read(4))[0]
+    fd.seek(length, SEEK_CUR)
+
+
+def read_chunk(fd, animation_filter=None, animations=None):
     header = fd.read(8)
     if header == b'':
         raise ErrorChunkEOF
@@ -20,10 +40,81 @@ def read_chunk(fd):
         raise ErrorUnknownChunk(chunk_id)
 
     chunk = chunk_cls()
-    chunk.read_data(fd)
+    if chunk_cls is ChunkAnimations:
+        chunk.read_data(fd, animation_filter, animations)
+    else:
+        chunk.read_data(fd)
     return chunk
 
 
+def read_chunks(fd, chunk_classes):
+    chunks = {}
+    while True:
+        header = fd.read(8)
+        if len(header) < 8:
+            return chunks
+        chunk_id, length = unpack('<2I', header)
+        chunk_cls = id_to_chunk_cls(chunk_id)
+        if chunk_cls in chunk_classes:
+            chunk = chunk_cls()
+            chunk.read_data(fd)
+            chunks[chunk_cls] = chunk
+        else:
+            fd.seek(length, SEEK_CUR)
+
+
+def probe_model(fd):
+    if fd.read(4) != MODEL_MAGIC:
+        raise ErrorInvalidModel
+
+    # seeking past the end does not fail, so truncated chunks are found by their length
+    offset = fd.tell()
+    size = fd.seek(0, SEEK_END)
+    fd.seek(offset)
+
+    info = ModelInfo()
+    while True:
+        header = fd.read(8)
+        if header == b'':
+            return info
+        if len(header) < 8:
+            raise ErrorTruncatedChunk(None)
+        chunk_id, length = unpack('<2I', header)
+        end = fd.tell() + length
+        if end > size:
+            raise ErrorTruncatedChunk(chunk_id)
+        info.chunks.append((chunk_id, length))
+
+        chunk_cls = id_to_chunk_cls(chunk_id)
+        if chunk_cls is ChunkVertices:
+            info.vertices_num = unpack('<I', fd.read(4))[0]
+        elif chunk_cls is ChunkIndices:
+            info.triangles_num = unpack('<I', fd.read(4))[0] // 3
+        elif chunk_cls is ChunkFaceSets:
+            info.face_sets_num = unpack('<I', fd.read(4))[0]
+        elif chunk_cls is ChunkMaterials:
+            materials_num = unpack('<I', fd.read(4))[0]
+            info.material_names = [read_string(fd) for _ in range(materials_num)]
+        elif chunk_cls is ChunkBones:
+            bones_num = unpack('<I', fd.read(4))[0]
+            for _ in range(bones_num):
+                info.bone_names.append(read_string(fd))
+                info.bone_parents.append(unpack('<i', fd.read(4))[0])
+                fd.seek(60, SEEK_CUR)
+        elif chunk_cls is ChunkAnimations:
+            animations_num = unpack('<I', fd.read(4))[0]
+            info.frames_nums = [Animation.skip(fd) for _ in range(animations_num)]
+        elif chunk_cls is ChunkSequences:
+            sequences_num = unpack('<I', fd.read(4))[0]
+            for _ in range(sequences_num):
+                info.sequence_names.append(read_string(fd))
+                fd.seek(8, SEEK_CUR)
+        elif chunk_cls is ChunkAnimationModel:
+            info.animation_model = read_string(fd)
+
+        fd.seek(end)
+
+
 def id_to_chunk_cls(chunk_id):
     chunks = {
         1: ChunkVertices,
@@ -46,6 +137,21 @@ class ErrorChunkEOF(Exception):
     pass
 
 
+class ErrorInvalidModel(Exception):
+    def __str__(self):
+        return 'Invalid model format'
+
+
+class ErrorTruncatedChunk(Exception):
+    def __init__(self, chunk_id):
+        self.chunk_id = chunk_id
+
+    def __str__(self):
+        if self.chunk_id is None:
+            return 'Truncated chunk header'
+        return 'Chunk %d runs past the end of the file' % self.chunk_id
+
+
 class ErrorUnknownChunk(Exception):
     def __init__(self, chunk_id):
         self.chunk_id = chunk_id
@@ -54,6 +160,24 @@ class ErrorUnknownChunk(Exception):
         return 'Unknown chunk id: %d' % self.chunk_id
 
 
+class ModelInfo:
+    def __init__(self):
+        self.chunks = []
+        self.vertices_num = 0
+        self.triangles_num = 0
+        self.face_sets_num = 0
+        self.material_names = []
+        self.bone_names = []
+        self.bone_parents = []
+        self.frames_nums = []
+        self.sequence_names = []
+        self.animation_model = None
+
+    @property
+    def animations_num(self):
+        return len(self.frames_nums)
+
+
 class ChunkVertices:
     def read_data(self, fd):
         vertices_num = unpack('<I', fd.read(4))[0]
@@ -85,9 +209,17 @@ class ChunkBones:
 
 
 class ChunkAnimations:
-    def read_data(self, fd):
+    def read_data(self, fd, animation_filter=None, animations=None):
         animations_num = unpack('<I', fd.read(4))[0]
-        self.animations = [Animation.read(fd) for _ in range(animations_num)]
+        # requested sequence names the model does not have, None when not filtered by sequences
+        self.missing_sequences = None
+        self.animations = []
+        for i in range(animations_num):
+            if animations is None or i in animations:
+                self.animations.append(Animation.read(fd, animation_filter))
+            else:
+                Animation.skip(fd)
+                self.animations.append(None)
 
 
 class ChunkAnimationNodes:
@@ -131,19 +263,74 @@ class NodeType(Enum):
     LAYER = 3
 
 
+class AnimationFilter:
+    def __init__(self, frame_start=0, frame_end=-1, frame_step=1, sequence_names=()):
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.frame_step = frame_step
+        self.sequence_names = sequence_names
+
+    def frames(self, keys_num):
+        end = keys_num if self.frame_end < 0 else min(self.frame_end + 1, keys_num)
+        return range(min(self.frame_start, end), end, self.frame_step)
+
+    def sequence_animations(self, chunk_sequences, chunk_animation_nodes):
+        """Return indices of animations used by the selected sequences and the selected names not found,
+        or None, None when the model has no sequences to select from."""
+        if not chunk_sequences or not chunk_animation_nodes:
+            return None, None
+
+        animations = set()
+        sequences = [s for s in chunk_sequences.sequences if s.name in self.sequence_names]
+        missing = set(self.sequence_names).difference(s.name for s in sequences)
+
+        nodes = [s.animation_node for s in sequences]
+        visited = set()
+        while nodes:
+            n = nodes.pop()
+            if n in visited:
+                continue
+            visited.add(n)
+
+            an = chunk_animation_nodes.animation_nodes[n]
+            if an.node_type == NodeType.ANIMATION:
+                animations.add(an.data.animation)
+            else:
+                nodes.extend(an.data.animations)
+
+        return animations, missing
+
+
 class Coords:
-    def __init__(self, x_axis, y_axis, z_axis, origin):
-        self.x_axis = x_axis
-        self.y_axis = y_axis
-        self.z_axis = z_axis
-        self.origin = origin
+    # packed as float32 array: x axis, y axis, z axis, origin
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
 
     @classmethod
     def read(cls, fd):
-        data = unpack("<12f", fd.read(48))
-        return cls(data[0:3], data[3:6], data[6:9], data[9:12])
+        return cls(array('f', unpack("<12f", fd.read(48))))
+
+    @property
+    def x_axis(self):
+        return self.data[0:3]
+
+    @property
+    def y_axis(self):
+        return self.data[3:6]
+
+    @property
+    def z_axis(self):
+        return self.data[6:9]
+
+    @property
+    def origin(self):
+        return self.data[9:12]
 
     def to_mat4x4(self):
+        from mathutils import Matrix
+
         mat = Matrix()
         mat[0][0] = self.x_axis[0]
         mat[1][0] = self.x_axis[1]
@@ -169,24 +356,39 @@ class Coords:
 
 
 class AffineParts:
-    def __init__(self, translation, rotation, scale, scale_rotation, flip):
-        self.translation = translation
-        self.rotation = rotation
-        self.scale = scale
-        self.scale_rotation = scale_rotation
-        self.flip = flip
+    # packed as float32 array: translation, rotation, scale, scale rotation, flip
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
 
     @classmethod
     def read(cls, fd):
-        data = unpack("<3f4f3f4ff", fd.read(60))
-        return cls(
-            data[0:3],
-            data[3:7],
-            data[7:10],
-            data[10:14],
-            data[14])
+        return cls(array('f', unpack("<3f4f3f4ff", fd.read(60))))
+
+    @property
+    def translation(self):
+        return self.data[0:3]
+
+    @property
+    def rotation(self):
+        return self.data[3:7]
+
+    @property
+    def scale(self):
+        return self.data[7:10]
+
+    @property
+    def scale_rotation(self):
+        return self.data[10:14]
+
+    @property
+    def flip(self):
+        return self.data[14]
 
     def to_mat4x4(self):
+        from mathutils import Matrix, Quaternion
+
         mat = Matrix.Translation(self.translation)
         scale_mat = Matrix.Identity(4)
         scale_mat[0][0], scale_mat[1][1], scale_mat[2][2] = self.scale
@@ -204,6 +406,8 @@ class AffineParts:
 
 
 class Vertex:
+    __slots__ = ('co', 'nrm', 'tan', 'bin', 'uv', 'bone_weights')
+
     def __init__(self, co, nrm, tan, bin, uv, bone_weights):
         self.co = co
         self.nrm = nrm
@@ -225,6 +429,8 @@ class Vertex:
 
 
 class FaceSet:
+    __slots__ = ('mat_index', 'first_face', 'faces_num', 'bones')
+
     def __init__(self, mat_index, first_face, faces_num, bones):
         self.mat_index = mat_index
         self.first_face = first_face
@@ -239,6 +445,8 @@ class FaceSet:
 
 
 class Bone:
+    __slots__ = ('name', 'parent', 'affine_parts')
+
     def __init__(self, name, parent, affine_parts):
         self.name = name
         self.parent = parent
@@ -253,18 +461,22 @@ class Bone:
 
 
 class Animation:
-    def __init__(self, flags, duration, curves, keys, frame_tags):
+    __slots__ = ('flags', 'duration', 'curves', 'keys', 'frame_tags', 'frames')
+
+    def __init__(self, flags, duration, curves, keys, frame_tags, frames):
         self.flags = flags
         self.duration = duration
         self.curves = curves
         self.keys = keys
         self.frame_tags = frame_tags
+        self.frames = frames
 
 
     @classmethod
-    def read(cls, fd):
+    def read(cls, fd, animation_filter=None):
         curves, keys, frame_tags = None, {}, {}
         flags, keys_num, duration, compressed_animation = unpack("<IIfI", fd.read(16))
+        frames = animation_filter.frames(keys_num) if animation_filter else range(keys_num)
 
         if compressed_animation:
             curves_num = unpack('<I', fd.read(4))[0]
@@ -273,7 +485,12 @@ class Animation:
         bones_num = unpack('<I', fd.read(4))[0]
         for _ in range(bones_num):
             bone = unpack('<I', fd.read(4))[0]
-            vals = [AffineParts.read(fd) for k in range(keys_num)]
+            offset = fd.tell()
+            vals = []
+            for f in frames:
+                fd.seek(offset + 60 * f)
+                vals.append(AffineParts.read(fd))
+            fd.seek(offset + 60 * keys_num)
             keys[bone] = vals
 
         frame_tags_num = unpack('<I', fd.read(4))[0]
@@ -282,10 +499,31 @@ class Animation:
             frame_name = read_string(fd)
             frame_tags[frame] = frame_name
 
-        return cls(flags, duration, curves, keys, frame_tags)
+        return cls(flags, duration, curves, keys, frame_tags, frames)
+
+    @staticmethod
+    def skip(fd):
+        keys_num, compressed_animation = unpack("<4xI4xI", fd.read(16))
+
+        if compressed_animation:
+            curves_num = unpack('<I', fd.read(4))[0]
+            for _ in range(curves_num):
+                AnimationCurve.skip(fd)
+
+        bones_num = unpack('<I', fd.read(4))[0]
+        fd.seek(bones_num * (4 + 60 * keys_num), SEEK_CUR)
+
+        frame_tags_num = unpack('<I', fd.read(4))[0]
+        for _ in range(frame_tags_num):
+            fd.seek(4, SEEK_CUR)
+            skip_string(fd)
+
+        return keys_num
 
 
 class AnimationCurve:
+    __slots__ = ('pos_keys', 'scale_keys', 'flip_keys', 'rot_keys', 'rot_scale_keys')
+
     def __init__(self, pos_keys, scale_keys, flip_keys, rot_keys, rot_scale_keys):
         self.pos_keys = pos_keys
         self.scale_keys = scale_keys
@@ -317,8 +555,17 @@ class AnimationCurve:
 
         return cls(pos_keys, scale_keys, flip_keys, rot_keys, rot_scale_keys)
 
+    @staticmethod
+    def skip(fd):
+        # time and value sizes of position, scale, flip, rotation and rotation scale keys
+        for key_size in (16, 16, 8, 20, 20):
+            keys_num = unpack('<I', fd.read(4))[0]
+            fd.seek(key_size * keys_num, SEEK_CUR)
+
 
 class AnimationNode:
+    __slots__ = ('node_type', 'flags', 'data')
+
     def __init__(self, node_type, flags, data):
         self.node_type = node_type
         self.flags = flags
@@ -340,6 +587,8 @@ class AnimationNode:
 
 
 class AnimNodeAnimation:
+    __slots__ = ('animation',)
+
     def __init__(self, animation):
         self.animation = animation
 
@@ -351,6 +600,8 @@ class AnimNodeAnimation:
 
 
 class AnimNodeBlend:
+    __slots__ = ('animations', 'param', 'min_val', 'max_val')
+
     def __init__(self, animations, param, min_val, max_val):
         self.animations = animations
         self.param = param
@@ -366,6 +617,8 @@ class AnimNodeBlend:
 
 
 class AnimNodeLayer:
+    __slots__ = ('animations',)
+
     def __init__(self, animations):
         self.animations = animations
 
@@ -378,6 +631,8 @@ class AnimNodeLayer:
 
 
 class Sequence:
+    __slots__ = ('name', 'animation_node', 'length')
+
     def __init__(self, name, animation_node, length):
         self.name = name
         self.animation_node = animation_node
@@ -392,6 +647,8 @@ class Sequence:
 
 
 class Camera:
+    __slots__ = ('name', 'bone', 'fov', 'coords')
+
     def __init__(self, name, bone, fov, coords):
         self.name = name
         self.bone = bone
@@ -408,6 +665,8 @@ class Camera:
 
 
 class AttachPoint:
+    __slots__ = ('name', 'bone', 'coords')
+
     def __init__(self, name, bone, coords):
         self.name = name
         self.bone = bone